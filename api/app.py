@@ -8,9 +8,12 @@ from werkzeug.utils import secure_filename
 from google.cloud import storage
 import uuid
 from datetime import datetime
-import tempfile
 from query_data import search_amazon
 from image_analyzer import analyze_image
+from image_intake import ImageIntakeRequest, ImageRejected, DecodeCapacityExceeded, DECODE_WAIT_TIMEOUT
+import shared_cache
+import embedding_versions
+import head_queries
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -31,48 +34,75 @@ INDEX_NAME = os.environ.get("INDEX_NAME")
 GCP_CREDENTIALS_PATH = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', 'C:/Users/Administrator/newera/aiprod/backend/adkprojects-fbca87841b6f.json')
 
 
-# Initialize GCP Storage client with service account credentials
-try:
-    # Check if credentials file exists
-    if not os.path.exists(GCP_CREDENTIALS_PATH):
-        raise FileNotFoundError(f"Service account key file not found: {GCP_CREDENTIALS_PATH}")
+storage_client = None
+bucket = None
+
+
+def init_storage():
+    """
+    Initialize the GCP Storage client with service account credentials.
+
+    Called at import time and again in every gunicorn worker after the fork
+    (see post_fork in gunicorn.conf.py): the bucket check opens a pooled HTTPS
+    connection, and a connection inherited from the master would be shared
+    by all workers.
+    """
+    global storage_client, bucket
+    try:
+        # Check if credentials file exists
+        if not os.path.exists(GCP_CREDENTIALS_PATH):
+            raise FileNotFoundError(f"Service account key file not found: {GCP_CREDENTIALS_PATH}")
     
-    # Load credentials from service account key file
-    credentials = service_account.Credentials.from_service_account_file(
-        GCP_CREDENTIALS_PATH,
-        scopes=['https://www.googleapis.com/auth/cloud-platform']
-    )
+        # Load credentials from service account key file
+        credentials = service_account.Credentials.from_service_account_file(
+            GCP_CREDENTIALS_PATH,
+            scopes=['https://www.googleapis.com/auth/cloud-platform']
+        )
     
-    # Initialize storage client with credentials
-    storage_client = storage.Client(
-        project=GCP_PROJECT_ID,
-        credentials=credentials
-    )
+        # Initialize storage client with credentials
+        storage_client = storage.Client(
+            project=GCP_PROJECT_ID,
+            credentials=credentials
+        )
     
-    bucket = storage_client.bucket(GCP_BUCKET_NAME)
+        bucket = storage_client.bucket(GCP_BUCKET_NAME)
     
-    # Test bucket access
-    if bucket.exists():
-        logger.info(f"Successfully connected to GCP Storage bucket: {GCP_BUCKET_NAME}")
-    else:
-        raise Exception(f"Bucket {GCP_BUCKET_NAME} does not exist or is not accessible")
+        # Test bucket access
+        if bucket.exists():
+            logger.info(f"Successfully connected to GCP Storage bucket: {GCP_BUCKET_NAME}")
+        else:
+            raise Exception(f"Bucket {GCP_BUCKET_NAME} does not exist or is not accessible")
         
-except FileNotFoundError as e:
-    logger.error(f"Credentials file error: {str(e)}")
-    logger.error("Please ensure GOOGLE_APPLICATION_CREDENTIALS environment variable points to your service account key JSON file")
-    storage_client = None
-    bucket = None
-except Exception as e:
-    logger.error(f"Failed to initialize GCP Storage: {str(e)}")
-    logger.error("Please check your GCP credentials, project ID, and bucket name")
-    storage_client = None
-    bucket = None
+    except FileNotFoundError as e:
+        logger.error(f"Credentials file error: {str(e)}")
+        logger.error("Please ensure GOOGLE_APPLICATION_CREDENTIALS environment variable points to your service account key JSON file")
+        storage_client = None
+        bucket = None
+    except Exception as e:
+        logger.error(f"Failed to initialize GCP Storage: {str(e)}")
+        logger.error("Please check your GCP credentials, project ID, and bucket name")
+        storage_client = None
+        bucket = None
+
+
+def close_storage():
+    """Close the pooled connections of the storage client in this process"""
+    if storage_client is not None:
+        storage_client._http.close()
+
+
+init_storage()
 
 
 app = Flask(__name__)
+app.request_class = ImageIntakeRequest  # Validate image headers while uploads stream in
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 CORS(app)  # Enable CORS for all routes
 
+# Load the shared read-only structures at import time. Under gunicorn with
+# preload_app this happens once in the master and the workers share them.
+shared_cache.load_all()
+
 def allowed_file(filename):
     """Check if the file extension is allowed"""
     return '.' in filename and \
@@ -119,27 +149,6 @@ def delete_from_gcs(gcs_filename):
     except Exception as e:
         logger.warning(f"Failed to delete file from GCS {gcs_filename}: {str(e)}")
 
-def download_from_gcs(gcs_filename):
-    """Download file from Google Cloud Storage to temporary file"""
-    try:
-        if not bucket:
-            raise Exception("GCP Storage not initialized")
-        
-        blob = bucket.blob(gcs_filename)
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        
-        # Download to temporary file
-        blob.download_to_filename(temp_file.name)
-        
-        logger.info(f"File downloaded from GCS to temporary file: {temp_file.name}")
-        return temp_file.name
-        
-    except Exception as e:
-        logger.error(f"Error downloading from GCS: {str(e)}")
-        raise
-
 
 @app.route('/')
 def home():
@@ -161,8 +170,13 @@ def search():
             return jsonify({"error": "Category must be a valid integer"}), 400
     
     try:
-        # Use search_amazon function from query_amazon.py
-        results = search_amazon(query, category)
+        # Serve head queries from the precomputed results, skipping the
+        # Gemini and Atlas calls; everything else runs the full pipeline
+        head_queries.record(query, category)
+        results = head_queries.lookup(query, category)
+        if results is None:
+            # Use search_amazon function from query_amazon.py
+            results = search_amazon(query, category)
         
         # Log results to verify links are included
         for i, result in enumerate(results):
@@ -178,17 +192,35 @@ def search():
         logger.error(f"Error processing search request: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/search/dual-read-stats')
+def dual_read_stats():
+    # Recall and latency of the shadow embedding version across all workers
+    return jsonify(embedding_versions.dual_read_stats())
+
+@app.route('/api/search/head-query-stats')
+def head_query_stats():
+    # Hit rate of the precomputed head-query results across all workers
+    return jsonify(head_queries.stats())
+
 @app.route('/api/upload-image', methods=['POST'])
 def upload_image():
     # Check if GCP Storage is available
     if not storage_client or not bucket:
         return jsonify({"error": "Cloud storage not available"}), 503
     
+    # Parse the upload; the image header is validated before the rest of
+    # the body is read, so invalid or oversized images are rejected early
+    try:
+        files = request.files
+    except ImageRejected as e:
+        logger.warning(f"Rejected image upload: {str(e)}")
+        return jsonify({"error": str(e)}), e.status_code
+    
     # Check if an image was included in the request
-    if 'image' not in request.files:
+    if 'image' not in files:
         return jsonify({"error": "No image file provided"}), 400
     
-    file = request.files['image']
+    file = files['image']
     
     # Check if the file is empty
     if file.filename == '':
@@ -198,8 +230,13 @@ def upload_image():
     if not allowed_file(file.filename):
         return jsonify({"error": "File type not allowed. Please use jpg, jpeg, png, or gif."}), 400
     
-    gcs_filename = None
-    temp_filepath = None
+    # Check that the header was recognised (too short files never are)
+    image_info = getattr(file.stream, 'image_info', None)
+    if image_info is None:
+        return jsonify({"error": "File is not a valid jpg, png or gif image"}), 400
+    
+    image_format, width, height = image_info
+    logger.info(f"Accepted {image_format} upload ({width}x{height})")
     
     try:
         # Get the query text if provided
@@ -212,12 +249,10 @@ def upload_image():
         gcs_filename, public_url = upload_to_gcs(file, filename)
         logger.info(f"Image uploaded to GCS: {gcs_filename}")
         
-        # Download the file to a temporary location for processing
-        temp_filepath = download_from_gcs(gcs_filename)
-        
-        # Process the image with Gemini API
-        with open(temp_filepath, 'rb') as img_file:
-            image_description = analyze_image(img_file, f"Describe this product in less than 50 words: {query_text}")
+        # Process the image with Gemini API, reading the already received
+        # upload instead of downloading another copy from GCS
+        file.stream.seek(0)
+        image_description = analyze_image(file.stream, f"Describe this product in less than 50 words: {query_text}")
         
         logger.info(f"Image description: {image_description}")
         
@@ -234,6 +269,9 @@ def upload_image():
         # Perform the search with the combined query
         results = search_amazon(combined_query)
         
+        # Optionally delete from GCS after processing (uncomment if you don't want to keep images)
+        # delete_from_gcs(gcs_filename)
+        
         return jsonify({
             "query": combined_query,
             "image_description": image_description,
@@ -242,23 +280,18 @@ def upload_image():
             "total_results": len(results)
         })
         
+    except DecodeCapacityExceeded as e:
+        # Shed the request rather than running a search without the image
+        logger.warning(f"Rejected image search under load: {str(e)}")
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(int(DECODE_WAIT_TIMEOUT))
+        return response, 503
     except Exception as e:
         logger.error(f"Error processing image search: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
-        
-    finally:
-        # Clean up temporary file
-        if temp_filepath:
-            try:
-                os.remove(temp_filepath)
-                logger.info(f"Temporary file {temp_filepath} removed")
-            except Exception as e:
-                logger.warning(f"Failed to remove temporary file {temp_filepath}: {str(e)}")
-        
-        # Optionally delete from GCS after processing (uncomment if you don't want to keep images)
-        # if gcs_filename:
-        #     delete_from_gcs(gcs_filename)
+
 
 if __name__ == '__main__':
+    # Development server only; production runs gunicorn with gunicorn.conf.py
     logger.info("Starting Flask server on port 5000")
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
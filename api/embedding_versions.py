@@ -0,0 +1,315 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import params
+from pymongo import ReturnDocument
+import search_stats
+from langchain_mongodb import MongoDBAtlasVectorSearch
+from gemini_embeddings import GeminiEmbeddings
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds the search config is cached before it is read again, so a cutover
+# reaches every worker within this window
+CONFIG_TTL = 30
+
+# _id of the document in the search config collection
+CONFIG_ID = "embedding"
+
+# Share of live searches compared against the shadow when dual-read is on,
+# unless the search config sets its own sample_rate
+DEFAULT_SAMPLE_RATE = 0.1
+# Threads running dual-read comparisons in each worker, and how many
+# comparisons may be queued or running before new ones are dropped
+DUAL_READ_THREADS = int(os.environ.get('DUAL_READ_THREADS', 2))
+DUAL_READ_MAX_PENDING = int(os.environ.get('DUAL_READ_MAX_PENDING', 4))
+
+_config_cache = {"value": None, "loaded_at": 0.0}
+_config_lock = threading.Lock()
+
+# Per-process executor for the comparisons (threads do not survive a fork)
+_executor = {"pid": None, "executor": None}
+_pending_comparisons = threading.BoundedSemaphore(DUAL_READ_MAX_PENDING)
+
+
+def get_spec(version):
+    """
+    Return the model specification of an embedding version.
+
+    Args:
+        version (str): Key in params.embedding_models, e.g. "v1"
+
+    Returns:
+        dict: model, dimensions, output_dimensionality, field and index_name
+        of the version
+    """
+    if version not in params.embedding_models:
+        raise ValueError(f"Unknown embedding version: {version}")
+    return params.embedding_models[version]
+
+
+def embeddings_for(version):
+    """Return a GeminiEmbeddings instance for an embedding version"""
+    spec = get_spec(version)
+    return GeminiEmbeddings(
+        model=spec["model"],
+        dimensions=spec["dimensions"],
+        output_dimensionality=spec.get("output_dimensionality"),
+    )
+
+
+def vector_store(collection, version):
+    """Return a vector store reading the vectors of an embedding version"""
+    spec = get_spec(version)
+    return MongoDBAtlasVectorSearch(
+        collection,
+        embeddings_for(version),
+        index_name=spec["index_name"],
+        embedding_key=spec["field"],
+    )
+
+
+def index_definition(version):
+    """Return the Atlas vector search index definition for an embedding version"""
+    spec = get_spec(version)
+    return {
+        "fields": [
+            {
+                "type": "vector",
+                "path": spec["field"],
+                "numDimensions": spec["dimensions"],
+                "similarity": "cosine"
+            },
+            {
+                "type": "filter",
+                "path": "index"
+            }
+        ]
+    }
+
+
+def default_config():
+    """Search config used when none has been stored yet"""
+    return {
+        "_id": CONFIG_ID,
+        "active": params.default_embedding_version,
+        "shadow": None,
+        "dual_read": False,
+        "sample_rate": DEFAULT_SAMPLE_RATE,
+    }
+
+
+def load_config(db):
+    """Read the search config from the database, bypassing the cache"""
+    stored = db[params.search_config_collection].find_one({"_id": CONFIG_ID})
+    config = default_config()
+    if stored:
+        config.update(stored)
+    return config
+
+
+def get_config(db):
+    """
+    Return the search config, re-reading it at most every CONFIG_TTL seconds.
+
+    Args:
+        db: pymongo database holding the search config collection
+
+    Returns:
+        dict: active version, shadow version, whether dual-read is on and the
+        share of searches it samples
+    """
+    now = time.monotonic()
+    if _config_cache["value"] is None or now - _config_cache["loaded_at"] > CONFIG_TTL:
+        with _config_lock:
+            if _config_cache["value"] is None or now - _config_cache["loaded_at"] > CONFIG_TTL:
+                try:
+                    _config_cache["value"] = load_config(db)
+                except Exception as e:
+                    logger.error(f"Failed to read search config: {str(e)}")
+                    if _config_cache["value"] is None:
+                        _config_cache["value"] = default_config()
+                _config_cache["loaded_at"] = now
+    return _config_cache["value"]
+
+
+def set_shadow(db, version, dual_read=False, sample_rate=None):
+    """Register the version being built next to the active one"""
+    if version is not None:
+        get_spec(version)
+    update = {"shadow": version, "dual_read": bool(dual_read and version)}
+    if sample_rate is not None:
+        update["sample_rate"] = min(max(float(sample_rate), 0.0), 1.0)
+    db[params.search_config_collection].update_one(
+        {"_id": CONFIG_ID},
+        {
+            "$set": update,
+            "$setOnInsert": {"active": params.default_embedding_version},
+        },
+        upsert=True
+    )
+
+
+def cutover(db, version):
+    """
+    Atomically make a version the active one.
+
+    The switch is a single find-and-update, so every search either uses the
+    old version or the new one, and the previous version read back is the one
+    that was replaced even if two cutovers race. It is kept as the shadow, so
+    rolling back is another cutover.
+
+    Returns:
+        str: The previously active version
+
+    Raises:
+        ValueError: If the version is unknown or already active
+    """
+    get_spec(version)
+    configs = db[params.search_config_collection]
+    configs.update_one(
+        {"_id": CONFIG_ID},
+        {"$setOnInsert": {"active": params.default_embedding_version}},
+        upsert=True
+    )
+    previous = configs.find_one_and_update(
+        {"_id": CONFIG_ID, "active": {"$ne": version}},
+        [{"$set": {
+            "shadow": {"$ifNull": ["$active", params.default_embedding_version]},
+            "active": version,
+            "dual_read": False,
+            "activated_at": time.time(),
+        }}],
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        raise ValueError(f"Version {version} is already active")
+    return previous["active"]
+
+
+def tag_existing(collection, version):
+    """
+    Tag documents that already hold a vector in the version's field.
+
+    Documents ingested before versions were tracked have vectors but no
+    ``embedding_versions`` tag; this one-time backfill makes them count as
+    migrated for status and cutover.
+
+    Returns:
+        int: Number of documents tagged
+    """
+    spec = get_spec(version)
+    result = collection.update_many(
+        {spec["field"]: {"$exists": True}, "embedding_versions": {"$ne": version}},
+        {"$addToSet": {"embedding_versions": version}}
+    )
+    return result.modified_count
+
+
+def missing_count(collection, version):
+    """Number of documents that have no vector for a version yet"""
+    return collection.count_documents({"embedding_versions": {"$ne": version}})
+
+
+def _doc_key(doc):
+    """Identity of a search result across versions"""
+    return doc.metadata.get("index", doc.page_content)
+
+
+def compare(collection, query, k, active_docs, active_ms, shadow_version):
+    """
+    Run a query against the shadow version and compare it with the active one.
+
+    Recall is the share of the active results also returned by the shadow.
+
+    Returns:
+        dict: overlap and latency of both versions for this query
+    """
+    start = time.perf_counter()
+    shadow_docs = vector_store(collection, shadow_version).similarity_search(query, k=k)
+    shadow_ms = (time.perf_counter() - start) * 1000
+
+    active_keys = {_doc_key(doc) for doc in active_docs}
+    shadow_keys = {_doc_key(doc) for doc in shadow_docs}
+    overlap = len(active_keys & shadow_keys) / len(active_keys) if active_keys else 1.0
+
+    logger.info(
+        f"Dual-read '{query}': overlap {overlap:.2f}, "
+        f"active {active_ms:.0f} ms, shadow ({shadow_version}) {shadow_ms:.0f} ms"
+    )
+    return {"overlap": overlap, "active_ms": active_ms, "shadow_ms": shadow_ms}
+
+
+def _get_executor():
+    """Return the comparison executor of this process, creating it after a fork"""
+    if _executor["pid"] != os.getpid():
+        _executor["executor"] = ThreadPoolExecutor(
+            max_workers=DUAL_READ_THREADS, thread_name_prefix="dual-read"
+        )
+        _executor["pid"] = os.getpid()
+    return _executor["executor"]
+
+
+def compare_in_background(collection, query, k, active_docs, active_ms, config):
+    """
+    Compare a sample of live searches with the shadow version.
+
+    Comparisons run on a small executor so they add no latency to the search.
+    A search is skipped when it is not sampled (``sample_rate`` in the search
+    config) or when DUAL_READ_MAX_PENDING comparisons are already in flight, so
+    dual-read never adds more than a bounded amount of upstream load.
+    """
+    if random.random() >= config.get("sample_rate", DEFAULT_SAMPLE_RATE):
+        return
+    if not _pending_comparisons.acquire(blocking=False):
+        logger.debug("Dual-read comparison dropped, executor is saturated")
+        return
+
+    def run():
+        try:
+            result = compare(collection, query, k, active_docs, active_ms, config["shadow"])
+            search_stats.increment(
+                search_stats.STATS_COLLECTION,
+                _dual_read_stats_id(config["active"], config["shadow"]),
+                queries=1, **result
+            )
+        except Exception as e:
+            logger.warning(f"Dual-read comparison failed: {str(e)}")
+        finally:
+            _pending_comparisons.release()
+
+    try:
+        _get_executor().submit(run)
+    except RuntimeError:
+        _pending_comparisons.release()
+
+
+def _dual_read_stats_id(active, shadow):
+    """_id of the dual-read totals of a pair of versions in the stats collection"""
+    return f"dual_read|{active}|{shadow}"
+
+
+def reset_dual_read_stats(db, active, shadow):
+    """Drop the dual-read totals of a pair of versions, e.g. when the shadow is rebuilt"""
+    db[search_stats.STATS_COLLECTION].delete_one({"_id": _dual_read_stats_id(active, shadow)})
+
+
+def dual_read_stats():
+    """Return the average overlap and latencies measured by all workers"""
+    config = get_config(search_stats.get_db())
+    totals = search_stats.totals(_dual_read_stats_id(config["active"], config["shadow"]))
+    queries = totals.get("queries", 0)
+    if not queries:
+        return {"active": config["active"], "shadow": config["shadow"], "queries": 0}
+    return {
+        "active": config["active"],
+        "shadow": config["shadow"],
+        "queries": queries,
+        "avg_overlap": totals.get("overlap", 0.0) / queries,
+        "avg_active_ms": totals.get("active_ms", 0.0) / queries,
+        "avg_shadow_ms": totals.get("shadow_ms", 0.0) / queries,
+    }
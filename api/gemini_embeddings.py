@@ -1,35 +1,47 @@
 import google.generativeai as genai
 
 class GeminiEmbeddings:
-    def __init__(self, model="models/embedding-001"):
+    def __init__(self, model="models/embedding-001", dimensions=768, output_dimensionality=None):
         self.model = model
-    
-    def embed_documents(self, texts):
-        """Embed a list of documents"""
+        self.dimensions = dimensions
+        self.output_dimensionality = output_dimensionality
+
+    def _embed(self, text):
+        """Embed a single text with the configured model and dimensions"""
+        kwargs = {}
+        if self.output_dimensionality:
+            # Only sent when set; not every model supports it
+            kwargs["output_dimensionality"] = self.output_dimensionality
+        result = genai.embed_content(
+            model=self.model,
+            content=text,
+            **kwargs
+        )
+        return result['embedding']
+
+    def embed_documents(self, texts, fallback=True):
+        """
+        Embed a list of documents.
+
+        Failed documents get a zero vector, or None when ``fallback`` is False
+        so callers that must not store placeholder vectors can skip them.
+        """
         embeddings = []
         for i, text in enumerate(texts):
             try:
-                result = genai.embed_content(
-                    model=self.model,
-                    content=text
-                )
-                embeddings.append(result['embedding'])
+                embeddings.append(self._embed(text))
                 if (i + 1) % 50 == 0:  # Progress indicator
                     print(f"Embedded {i + 1}/{len(texts)} documents")
             except Exception as e:
                 print(f"Error embedding document {i}: {e}")
                 # Use zero vector as fallback
-                embeddings.append([0.0] * 768)
+                embeddings.append([0.0] * self.dimensions if fallback else None)
         return embeddings
-    
+
     def embed_query(self, text):
         """Embed a single query"""
         try:
-            result = genai.embed_content(
-                model=self.model,
-                content=text
-            )
-            return result['embedding']
+            return self._embed(text)
         except Exception as e:
             print(f"Error embedding query: {e}")
-            return [0.0] * 768
\ No newline at end of file
+            return [0.0] * self.dimensions
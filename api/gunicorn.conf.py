@@ -0,0 +1,101 @@
+import math
+import os
+import signal
+import search_stats
+import shared_cache
+
+# Production serving configuration, picked up automatically by gunicorn
+# when it is started from this directory (see Dockerfile).
+
+bind = f":{os.environ.get('PORT', '5000')}"
+
+
+def available_cpus():
+    """
+    Number of CPUs this container may use.
+
+    Honours the cgroup CPU quota (v2 cpu.max, then v1 cfs quota) and the CPU
+    affinity mask, rather than the host core count.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    quota_files = [
+        ('/sys/fs/cgroup/cpu.max', None),
+        ('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '/sys/fs/cgroup/cpu/cpu.cfs_period_us'),
+    ]
+    for quota_path, period_path in quota_files:
+        try:
+            with open(quota_path) as f:
+                values = f.read().split()
+            if period_path:
+                with open(period_path) as f:
+                    values.append(f.read().strip())
+            quota, period = values[0], values[1]
+            if quota not in ('max', '-1'):
+                cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+            break
+        except (OSError, ValueError, IndexError):
+            continue
+    return max(1, cpus or 1)
+
+
+# One worker per usable CPU by default; override with WEB_CONCURRENCY
+workers = int(os.environ.get('WEB_CONCURRENCY', available_cpus()))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 0))
+
+# Import the app (and load the shared read-only structures) once in the
+# master so workers share them through copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    """
+    Freeze the preloaded structures before the first workers are forked and
+    start watching the reload marker published by the ingest jobs.
+    """
+    # The master never serves requests; drop the storage connection opened
+    # by the import-time bucket check so no socket is inherited by workers
+    import app
+    app.close_storage()
+
+    shared_cache.freeze()
+    shared_cache.watch_marker(lambda: os.kill(os.getpid(), signal.SIGHUP))
+    server.log.info(f"Serving with {workers} workers x {threads} threads")
+
+
+def on_reload(server):
+    """
+    Reload the shared structures in the master on SIGHUP (sent by the marker
+    watcher when an ingest publishes a reload).
+
+    Gunicorn then forks a new generation of workers from the master and
+    gracefully stops the old ones, so the workers pick up the fresh data
+    without a restart while memory stays close to a single copy.
+    """
+    server.log.info("Reloading shared structures")
+    shared_cache.load_all()
+    shared_cache.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Give each worker its own clients.
+
+    Clients holding pooled connections must not be shared across fork:
+    the storage client is rebuilt here. MongoDB clients are created per
+    process on first use (search_stats.get_db, per-call clients in
+    query_data) and the Gemini clients connect lazily, so nothing else
+    created at import time holds a connection.
+    """
+    import app
+    app.init_storage()
+
+
+def worker_exit(server, worker):
+    """
+    Write the worker's buffered stats before it exits.
+
+    Every reload replaces all workers, so without this each one would drop
+    its unflushed query counts and hit/miss counters.
+    """
+    search_stats.flush()
@@ -0,0 +1,177 @@
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import certifi
+import params
+from pymongo import MongoClient
+import embedding_versions
+import search_stats
+import shared_cache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Collection counting how often each normalized query is searched, one
+# document per query and day
+QUERY_STATS_COLLECTION = "query_stats"
+# Collection holding the precomputed results of the head queries
+RESULTS_COLLECTION = "head_query_results"
+# Name of the precomputed results in the shared cache
+CACHE_NAME = "head_query_results"
+
+# _id of the hit and miss counters in the search stats collection
+STATS_ID = "head_queries"
+
+# Days of query counts that decide which queries are in the head; older
+# counts expire through a TTL index on last_seen
+QUERY_WINDOW_DAYS = int(os.environ.get('HEAD_QUERY_WINDOW_DAYS', 7))
+
+# Seconds after which a worker reloads the precomputed results in the background
+HEAD_QUERY_TTL = int(os.environ.get('HEAD_QUERY_TTL', 3600))
+
+_lock = threading.Lock()
+_refresh_running = False
+_refresh_started = 0.0
+
+
+def query_key(query, category=None):
+    """
+    Normalize a query so that trivially different spellings share one entry.
+
+    Args:
+        query (str): Search query
+        category (int, optional): Category filter of the search
+
+    Returns:
+        str: Key used for the frequency counts and the precomputed results
+    """
+    normalized = " ".join(query.casefold().split())
+    return f"{category if category is not None else ''}|{normalized}"
+
+
+def load_results():
+    """
+    Load the precomputed head-query results.
+
+    Returns:
+        dict: query_key -> (embedding version the results were computed with, results)
+    """
+    with MongoClient(params.mongodb_conn_string, tlsCAFile=certifi.where()) as client:
+        collection = client[params.db_name][RESULTS_COLLECTION]
+        return {
+            doc["_id"]: (doc.get("embedding_version"), doc["results"])
+            for doc in collection.find({}, {"results": 1, "embedding_version": 1})
+        }
+
+
+shared_cache.register(CACHE_NAME, load_results)
+
+
+def _refresh_in_background():
+    """Reload the precomputed results without blocking the request"""
+    def run():
+        global _refresh_running
+        try:
+            shared_cache.reload(CACHE_NAME)
+        finally:
+            with _lock:
+                _refresh_running = False
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def lookup(query, category=None):
+    """
+    Return the precomputed results of a head query.
+
+    Args:
+        query (str): Search query
+        category (int, optional): Category filter of the search
+
+    Results computed with an embedding version other than the active one
+    (e.g. right after a cutover) are ignored. While dual-read is on, the same
+    sample of head queries as of other searches skips the cache, so the
+    comparison covers head traffic too.
+
+    Returns:
+        list: The stored results, or None if the search must run the full pipeline
+    """
+    global _refresh_running, _refresh_started
+    age = shared_cache.age(CACHE_NAME)
+    with _lock:
+        # Refresh stale results, retrying failed loads at most once per TTL
+        if (not _refresh_running
+                and (age is None or age > HEAD_QUERY_TTL)
+                and time.time() - _refresh_started > HEAD_QUERY_TTL):
+            _refresh_running = True
+            _refresh_started = time.time()
+            _refresh_in_background()
+
+    entry = (shared_cache.get(CACHE_NAME) or {}).get(query_key(query, category))
+    if entry is None:
+        outcome, results = "misses", None
+    else:
+        version, results = entry
+        config = embedding_versions.get_config(search_stats.get_db())
+        if version != config["active"]:
+            outcome, results = "stale_version", None
+        elif (config["dual_read"] and config["shadow"]
+                and random.random() < config.get("sample_rate", embedding_versions.DEFAULT_SAMPLE_RATE)):
+            outcome, results = "dual_read_bypass", None
+        else:
+            outcome = "hits"
+
+    search_stats.increment(search_stats.STATS_COLLECTION, STATS_ID, **{outcome: 1})
+    return results
+
+
+def record(query, category=None):
+    """Count a search in today's bucket; counts are written to MongoDB in batches"""
+    now = datetime.now(timezone.utc)
+    day = now.strftime("%Y-%m-%d")
+    key = query_key(query, category)
+    search_stats.increment(
+        QUERY_STATS_COLLECTION, f"{day}|{key}",
+        fields={"key": key, "day": day, "last_seen": now}, count=1
+    )
+
+
+def top_queries(db, top_n, min_count=1):
+    """
+    Return the most frequent queries of the last QUERY_WINDOW_DAYS days.
+
+    Also makes sure the TTL index expiring older daily counts exists.
+
+    Returns:
+        list: dicts with the query key as ``_id`` and its ``count``
+    """
+    stats = db[QUERY_STATS_COLLECTION]
+    stats.create_index("last_seen", expireAfterSeconds=(QUERY_WINDOW_DAYS + 1) * 86400)
+    since = (datetime.now(timezone.utc) - timedelta(days=QUERY_WINDOW_DAYS - 1)).strftime("%Y-%m-%d")
+    return list(stats.aggregate([
+        {"$match": {"day": {"$gte": since}}},
+        {"$group": {"_id": "$key", "count": {"$sum": "$count"}}},
+        {"$match": {"count": {"$gte": min_count}}},
+        {"$sort": {"count": -1}},
+        {"$limit": top_n},
+    ]))
+
+
+def stats():
+    """Return the head-query hit rate of all workers"""
+    totals = search_stats.totals(STATS_ID)
+    hits, misses = totals.get("hits", 0), totals.get("misses", 0)
+    stale_version = totals.get("stale_version", 0)
+    dual_read_bypass = totals.get("dual_read_bypass", 0)
+    total = hits + misses + stale_version + dual_read_bypass
+    return {
+        "hits": hits,
+        "misses": misses,
+        "stale_version": stale_version,
+        "dual_read_bypass": dual_read_bypass,
+        "hit_rate": hits / total if total else 0.0,
+        "cached_queries": len(shared_cache.get(CACHE_NAME) or {}),
+    }
@@ -4,6 +4,7 @@ import params
 import logging
 import io
 import os
+from image_intake import decode_semaphore, DecodeCapacityExceeded, DECODE_MAX_SIDE, DECODE_WAIT_TIMEOUT
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +31,9 @@ def analyze_image(image_file, prompt="Describe what is in this image concisely."
         
     Returns:
         str: Text description of the image content
+
+    Raises:
+        DecodeCapacityExceeded: If no decode slot frees up in time
     """
     if not GEMINI_API_KEY:
         return "Error: No Gemini API key configured"
@@ -45,12 +49,26 @@ def analyze_image(image_file, prompt="Describe what is in this image concisely."
         model = genai.GenerativeModel('gemini-1.5-flash')
         logger.info("Using gemini-1.5-flash model")
         
-        # Load and process the image
-        img = PIL.Image.open(image_file)
-        
-        # Ensure the image is in RGB mode (Gemini API requires RGB)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
+        # Limit the number of images decoded at once so a burst of large
+        # uploads cannot exhaust memory or CPU for the text searches
+        if not decode_semaphore.acquire(timeout=DECODE_WAIT_TIMEOUT):
+            raise DecodeCapacityExceeded("Too many images being processed, try again later")
+        try:
+            img = PIL.Image.open(image_file)
+            
+            # Let the decoder scale down while decoding (JPEG only), then
+            # shrink to the size the analysis actually needs
+            img.draft("RGB", (DECODE_MAX_SIDE, DECODE_MAX_SIDE))
+            img.thumbnail((DECODE_MAX_SIDE, DECODE_MAX_SIDE))
+            # thumbnail() skips small images without decoding them; force the
+            # decode here so it never happens later outside the semaphore
+            img.load()
+            
+            # Ensure the image is in RGB mode (Gemini API requires RGB)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+        finally:
+            decode_semaphore.release()
             
         logger.info(f"Image opened successfully. Size: {img.size}, Format: {img.format}, Mode: {img.mode}")
         
@@ -74,6 +92,9 @@ def analyze_image(image_file, prompt="Describe what is in this image concisely."
         logger.info(f"Image analysis result: {description}")
         return description
     
+    except DecodeCapacityExceeded:
+        # Overload: let the caller shed the request instead of searching anyway
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}", exc_info=True)
         return f"Error analyzing image: {str(e)}" 
\ No newline at end of file
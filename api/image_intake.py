@@ -0,0 +1,177 @@
+import logging
+import os
+import struct
+import threading
+from flask import Request
+from werkzeug.formparser import default_stream_factory
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bytes of an upload inspected for magic bytes and dimensions before the
+# rest of the body is read
+HEADER_PEEK_BYTES = int(os.environ.get('IMAGE_HEADER_PEEK_BYTES', 64 * 1024))
+# Largest accepted image, in pixels (width * height)
+MAX_IMAGE_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+# Longest side an image is decoded to for analysis
+DECODE_MAX_SIDE = int(os.environ.get('IMAGE_DECODE_MAX_SIDE', 1024))
+# Number of images decoded at the same time in one worker
+MAX_CONCURRENT_DECODES = int(os.environ.get('IMAGE_MAX_CONCURRENT_DECODES', 2))
+# Seconds to wait for a decode slot before giving up
+DECODE_WAIT_TIMEOUT = float(os.environ.get('IMAGE_DECODE_WAIT_TIMEOUT', 10))
+
+decode_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_DECODES)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# JPEG start-of-frame markers (carry the image dimensions)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageRejected(Exception):
+    """Raised when an upload is not an acceptable image"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _scan_jpeg(header, i=2):
+    """
+    Walk the JPEG markers up to the start-of-frame segment.
+
+    Returns:
+        tuple: ((width, height) or None, offset of the next unparsed marker).
+        The offset is past the end of ``header`` when a segment body has not
+        been fully received yet.
+    """
+    while i + 4 <= len(header):
+        if header[i] != 0xFF:
+            raise ImageRejected("Corrupt JPEG header")
+        marker = header[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length field
+            i += 2
+            continue
+        if marker == 0xDA:
+            raise ImageRejected("JPEG has no frame header before the image data")
+        segment_length = struct.unpack('>H', header[i + 2:i + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(header):
+                return None, i
+            height, width = struct.unpack('>HH', header[i + 5:i + 9])
+            return (width, height), i
+        i += 2 + segment_length
+    return None, i
+
+
+def inspect_header(header):
+    """
+    Identify an image and its dimensions from the first bytes of the file.
+
+    Args:
+        header (bytes): Beginning of the uploaded file
+
+    Returns:
+        tuple: (format, width, height), or None if more bytes are needed
+
+    Raises:
+        ImageRejected: If the bytes are not a supported image or it is too large
+    """
+    if len(header) < 10:
+        return None
+
+    if header.startswith(PNG_SIGNATURE):
+        if len(header) < 24:
+            return None
+        if header[12:16] != b'IHDR':
+            raise ImageRejected("Corrupt PNG header")
+        image_format = 'PNG'
+        width, height = struct.unpack('>II', header[16:24])
+    elif header[:6] in GIF_SIGNATURES:
+        image_format = 'GIF'
+        width, height = struct.unpack('<HH', header[6:10])
+    elif header.startswith(JPEG_SIGNATURE):
+        dimensions, _ = _scan_jpeg(header)
+        if dimensions is None:
+            return None
+        image_format = 'JPEG'
+        width, height = dimensions
+    else:
+        raise ImageRejected("File is not a jpg, png or gif image")
+
+    if width == 0 or height == 0:
+        raise ImageRejected("Image has no pixels")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"Image is too large ({width}x{height})", status_code=413)
+    return image_format, width, height
+
+
+class DecodeCapacityExceeded(Exception):
+    """Raised when no decode slot frees up within DECODE_WAIT_TIMEOUT"""
+
+
+class HeaderCheckedFile:
+    """
+    File-like wrapper that validates an upload while it is being received.
+
+    The multipart parser writes the body into this object chunk by chunk. The
+    first bytes are checked with ``inspect_header`` and the upload is rejected
+    before the rest of the body is read from the client. For JPEG, the bodies
+    of the segments before the frame header (EXIF, XMP, ICC...) are skipped as
+    they stream past, so only marker headers count against HEADER_PEEK_BYTES.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._header = b''
+        self._skip = 0
+        self.image_info = None
+
+    def _inspect(self, data):
+        """Feed the next chunk of the upload to the header check"""
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            self._skip -= skipped
+            data = data[skipped:]
+            if self._skip:
+                return
+        self._header += bytes(data)
+        self.image_info = inspect_header(self._header)
+
+        if self.image_info is None and self._header.startswith(JPEG_SIGNATURE[:2]):
+            # Keep the start-of-image marker and drop the parsed segments
+            _, next_marker = _scan_jpeg(self._header)
+            self._skip = max(0, next_marker - len(self._header))
+            self._header = self._header[:2] + self._header[next_marker:]
+
+        if self.image_info is None and len(self._header) >= HEADER_PEEK_BYTES:
+            raise ImageRejected("Could not read the image dimensions from its header")
+
+    def write(self, data):
+        if self.image_info is None:
+            self._inspect(data)
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+
+class ImageIntakeRequest(Request):
+    """Request class that validates uploaded images as they stream in"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        stream = default_stream_factory(
+            total_content_length, content_type, filename, content_length
+        )
+        return HeaderCheckedFile(stream)
@@ -0,0 +1,205 @@
+import argparse
+import time
+import params
+import os
+import google.generativeai as genai
+from pymongo import MongoClient, UpdateOne
+import embedding_versions
+import precompute_head_queries
+import shared_cache
+
+# Online migration between embedding models. Typical flow:
+#   python migrate_embeddings.py tag-existing v1   # once, for data ingested before versioning
+#   python migrate_embeddings.py build v2          # backfill shadow field + index
+#   python migrate_embeddings.py dual-read on --sample-rate 0.05  # compare live traffic
+#   python migrate_embeddings.py compare "red dress" "running shoes"
+#   python migrate_embeddings.py cutover v2        # atomic switch
+
+
+def create_index(db, version):
+    """Create the vector search index of a version if it does not exist yet"""
+    spec = embedding_versions.get_spec(version)
+    collection = db[params.collection_name]
+    existing = [index.get('name') for index in collection.list_search_indexes()]
+    if spec['index_name'] in existing:
+        print(f"Vector index '{spec['index_name']}' already exists")
+        return
+    print(f"Creating vector search index '{spec['index_name']}'...")
+    db.command({
+        "createSearchIndex": params.collection_name,
+        "name": spec['index_name'],
+        "definition": embedding_versions.index_definition(version)
+    })
+
+
+def build(db, version, batch_size):
+    """
+    Backfill the vectors of a version next to the active ones.
+
+    Only documents not yet tagged with the version are embedded, so the job
+    can be interrupted and re-run (e.g. after an ingest) without redoing work.
+    Dual-read is switched off while it runs.
+    """
+    spec = embedding_versions.get_spec(version)
+    config = embedding_versions.load_config(db)
+    if version == config["active"]:
+        print(f"Version {version} is already active")
+        return True
+
+    collection = db[params.collection_name]
+    embeddings = embedding_versions.embeddings_for(version)
+    # Comparing against a half-built index would only record noise: keep
+    # dual-read off until the backfill is done and start from fresh totals
+    embedding_versions.set_shadow(db, version, dual_read=False)
+    embedding_versions.reset_dual_read_stats(db, config["active"], version)
+    create_index(db, version)
+
+    total = embedding_versions.missing_count(collection, version)
+    print(f"Embedding {total} documents with {spec['model']} into '{spec['field']}'...")
+    done = 0
+    # Documents whose embedding failed stay untagged so a rerun retries them;
+    # skip them for the rest of this run
+    failed_ids = []
+    while True:
+        batch = list(collection.find(
+            {"embedding_versions": {"$ne": version}, "_id": {"$nin": failed_ids}},
+            {"text": 1}
+        ).limit(batch_size))
+        if not batch:
+            break
+        vectors = embeddings.embed_documents(
+            [doc.get("text", "") for doc in batch], fallback=False
+        )
+        updates = []
+        for doc, vector in zip(batch, vectors):
+            if vector is None:
+                failed_ids.append(doc["_id"])
+                continue
+            updates.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {spec['field']: vector},
+                 "$addToSet": {"embedding_versions": version}}
+            ))
+        if updates:
+            collection.bulk_write(updates)
+        done += len(updates)
+        print(f"Backfilled {done}/{total} documents ({len(failed_ids)} failed)")
+
+    if failed_ids:
+        print(f"{len(failed_ids)} documents could not be embedded; run build again to retry them")
+        return False
+    print(f"Shadow version {version} is ready; turn dual-read on to compare it on live traffic")
+    return True
+
+
+def compare(db, queries, k):
+    """Compare recall and latency of the active and shadow versions"""
+    config = embedding_versions.load_config(db)
+    if not config["shadow"]:
+        print("No shadow version configured")
+        return
+
+    collection = db[params.collection_name]
+    active_store = embedding_versions.vector_store(collection, config["active"])
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        docs = active_store.similarity_search(query, k=k)
+        active_ms = (time.perf_counter() - start) * 1000
+        results.append(embedding_versions.compare(
+            collection, query, k, docs, active_ms, config["shadow"]
+        ))
+
+    if results:
+        count = len(results)
+        print(f"Active {config['active']} vs shadow {config['shadow']} over {count} queries:")
+        print(f"  recall@{k}: {sum(r['overlap'] for r in results) / count:.2f}")
+        print(f"  active latency: {sum(r['active_ms'] for r in results) / count:.0f} ms")
+        print(f"  shadow latency: {sum(r['shadow_ms'] for r in results) / count:.0f} ms")
+
+
+def status(db):
+    """Print the search config and backfill progress of every version"""
+    config = embedding_versions.load_config(db)
+    collection = db[params.collection_name]
+    total = collection.count_documents({})
+    print(f"Active: {config['active']}  Shadow: {config['shadow']}  Dual-read: {config['dual_read']}")
+    for version, spec in params.embedding_models.items():
+        missing = embedding_versions.missing_count(collection, version)
+        print(f"  {version}: {spec['model']} ({spec['dimensions']}d) "
+              f"{total - missing}/{total} documents")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding model migration")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="Show versions and backfill progress")
+
+    tag_parser = subparsers.add_parser(
+        "tag-existing", help="Tag documents ingested before versions were tracked"
+    )
+    tag_parser.add_argument("version", nargs="?", default=params.default_embedding_version)
+
+    build_parser = subparsers.add_parser("build", help="Backfill a shadow version")
+    build_parser.add_argument("version")
+    build_parser.add_argument("--batch-size", type=int, default=100)
+
+    dual_read_parser = subparsers.add_parser("dual-read", help="Compare versions on live traffic")
+    dual_read_parser.add_argument("state", choices=["on", "off"])
+    dual_read_parser.add_argument("--sample-rate", type=float,
+                                  help="Share of live searches to compare (0-1)")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare versions on given queries")
+    compare_parser.add_argument("queries", nargs="+")
+    compare_parser.add_argument("-k", type=int, default=5)
+
+    cutover_parser = subparsers.add_parser("cutover", help="Make a version the active one")
+    cutover_parser.add_argument("version")
+    cutover_parser.add_argument("--force", action="store_true",
+                                help="Cut over even if some documents are not backfilled")
+
+    args = parser.parse_args()
+
+    genai.configure(api_key=params.gemini_api_key or os.getenv("GEMINI_API_KEY"))
+    client = MongoClient(params.mongodb_conn_string)
+    db = client[params.db_name]
+
+    if args.command == "status":
+        status(db)
+    elif args.command == "tag-existing":
+        tagged = embedding_versions.tag_existing(db[params.collection_name], args.version)
+        print(f"Tagged {tagged} existing documents with {args.version}")
+    elif args.command == "build":
+        if not build(db, args.version, args.batch_size):
+            exit(1)
+    elif args.command == "dual-read":
+        config = embedding_versions.load_config(db)
+        embedding_versions.set_shadow(db, config["shadow"], dual_read=args.state == "on",
+                                      sample_rate=args.sample_rate)
+        config = embedding_versions.load_config(db)
+        print(f"Dual-read {args.state} (shadow: {config['shadow']}, "
+              f"sample rate: {config['sample_rate']})")
+    elif args.command == "compare":
+        compare(db, args.queries, args.k)
+    elif args.command == "cutover":
+        missing = embedding_versions.missing_count(db[params.collection_name], args.version)
+        if missing and not args.force:
+            print(f"{missing} documents have no {args.version} vectors yet; run build first or use --force")
+            exit(1)
+        try:
+            previous = embedding_versions.cutover(db, args.version)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        print(f"Active version switched from {previous} to {args.version}; "
+              f"workers pick it up within {embedding_versions.CONFIG_TTL} seconds")
+
+        # Head-query results of the previous version are ignored from now on;
+        # recompute them with the new one
+        precompute_head_queries.precompute()
+        shared_cache.publish_reload()
+
+
+if __name__ == "__main__":
+    main()
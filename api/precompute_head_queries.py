@@ -0,0 +1,81 @@
+import argparse
+import time
+import certifi
+import params
+from pymongo import MongoClient
+import embedding_versions
+import head_queries
+import shared_cache
+from query_data import search_amazon
+
+# Offline job precomputing the results of the most frequent queries.
+# Schedule it like vectorize_data.py (which also runs it after each ingest):
+#   python precompute_head_queries.py --top 200
+
+
+def precompute(top_n=200, min_count=2):
+    """
+    Run the full search pipeline for the top N queries of the last
+    HEAD_QUERY_WINDOW_DAYS days and store the results.
+
+    Args:
+        top_n (int): Number of most frequent queries to precompute
+        min_count (int): Minimum number of searches in the window for a query to qualify
+
+    Returns:
+        int: Number of queries stored
+    """
+    client = MongoClient(params.mongodb_conn_string, tlsCAFile=certifi.where())
+    db = client[params.db_name]
+    results_collection = db[head_queries.RESULTS_COLLECTION]
+
+    top_queries = head_queries.top_queries(db, top_n, min_count)
+    # Tag the results so they are ignored once another version is active
+    embedding_version = embedding_versions.load_config(db)["active"]
+    print(f"Precomputing results for {len(top_queries)} head queries...")
+
+    generated_at = time.time()
+    stored = 0
+    for entry in top_queries:
+        key = entry["_id"]
+        category, query = key.split("|", 1)
+        category = int(category) if category else None
+        try:
+            results = search_amazon(query, category)
+        except Exception as e:
+            print(f"Error precomputing '{query}': {e}")
+            continue
+        if not results:
+            # Never cache an empty answer; it would be served as a hit
+            print(f"No results for '{query}', keeping previous results")
+            continue
+        results_collection.replace_one(
+            {"_id": key},
+            {"_id": key, "results": results, "count": entry["count"],
+             "embedding_version": embedding_version, "generated_at": generated_at},
+            upsert=True
+        )
+        stored += 1
+
+    # Drop queries that are no longer in the head. Queries that failed keep
+    # their previous results, so an upstream outage does not empty the cache.
+    results_collection.delete_many({"_id": {"$nin": [entry["_id"] for entry in top_queries]}})
+    print(f"Stored results for {stored} head queries")
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute results for head queries")
+    parser.add_argument("--top", type=int, default=200, help="Number of queries to precompute")
+    parser.add_argument("--min-count", type=int, default=2,
+                        help="Minimum number of searches for a query to be precomputed")
+    args = parser.parse_args()
+
+    precompute(args.top, args.min_count)
+
+    # Ask the running API server to load the new results
+    shared_cache.publish_reload()
+
+
+if __name__ == "__main__":
+    main()
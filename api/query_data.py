@@ -1,11 +1,11 @@
 import argparse
 import params
 import certifi
+import time
 import warnings
 from pymongo import MongoClient
-from langchain_mongodb import MongoDBAtlasVectorSearch
 from google import genai
-from gemini_embeddings import GeminiEmbeddings
+import embedding_versions
 
 
 # Filter out warnings
@@ -62,18 +62,24 @@ def search_amazon(query, category=None):
     client = MongoClient(params.mongodb_conn_string, tlsCAFile=certifi.where())
     collection = client[params.db_name][params.collection_name]
 
-    # Initialize vector store
-    embeddings = GeminiEmbeddings()
-    vectorStore = MongoDBAtlasVectorSearch(
-        collection, embeddings, index_name=params.index_name
-    )
+    # Initialize vector store for the active embedding version
+    search_config = embedding_versions.get_config(client[params.db_name])
+    vectorStore = embedding_versions.vector_store(collection, search_config["active"])
 
     # Process search results
     results = []
 
     if (not is_negated):
         # Perform similarity search
+        start = time.perf_counter()
         docs = vectorStore.similarity_search(query, k=5)  # Get more results to allow for filtering
+        active_ms = (time.perf_counter() - start) * 1000
+
+        # Compare with the shadow embedding version while it is being evaluated
+        if search_config["dual_read"] and search_config["shadow"]:
+            embedding_versions.compare_in_background(
+                collection, query, 5, docs, active_ms, search_config
+            )
 
         for doc in docs:
 
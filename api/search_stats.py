@@ -0,0 +1,136 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+import certifi
+import params
+from pymongo import MongoClient, UpdateOne
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Collection holding the counters reported by the stats endpoints
+STATS_COLLECTION = "search_stats"
+
+# Counters are buffered per worker and written in one batch every N
+# increments or seconds (a timer flushes quiet workers, and the buffer is
+# flushed on exit), so the endpoints see totals for all workers
+FLUSH_SIZE = int(os.environ.get('SEARCH_STATS_FLUSH_SIZE', 100))
+FLUSH_INTERVAL = int(os.environ.get('SEARCH_STATS_FLUSH_INTERVAL', 60))
+
+# (collection, _id) -> Counter of amounts to add
+_pending = {}
+# (collection, _id) -> fields to set with the increment
+_fields = {}
+_pending_events = 0
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+
+# Per-process timer thread flushing every FLUSH_INTERVAL seconds
+_timer = {"pid": None}
+
+# Per-process MongoDB client (pymongo clients must not be shared across fork)
+_client = {"pid": None, "client": None}
+
+
+def get_db():
+    """Return the database through the MongoDB client of this process"""
+    if _client["pid"] != os.getpid():
+        _client["client"] = MongoClient(params.mongodb_conn_string, tlsCAFile=certifi.where())
+        _client["pid"] = os.getpid()
+    return _client["client"][params.db_name]
+
+
+def increment(collection, doc_id, fields=None, **amounts):
+    """
+    Add to the counters of a document; the writes are batched.
+
+    Args:
+        collection (str): Collection holding the counters
+        doc_id (str): _id of the counters document
+        fields (dict, optional): Fields to set on the document with the increment
+        **amounts: Counter names and the amounts to add
+    """
+    global _pending_events
+    _ensure_timer()
+    with _lock:
+        key = (collection, doc_id)
+        _pending.setdefault(key, Counter()).update(amounts)
+        if fields:
+            _fields[key] = fields
+        _pending_events += 1
+        if (_pending_events < FLUSH_SIZE
+                and time.monotonic() - _last_flush < FLUSH_INTERVAL):
+            return
+        batch = _take_pending()
+
+    threading.Thread(target=_flush, args=batch, daemon=True).start()
+
+
+def _take_pending():
+    """Swap out the buffered counters; must be called with _lock held"""
+    global _pending_events, _last_flush
+    batch = (dict(_pending), dict(_fields))
+    _pending.clear()
+    _fields.clear()
+    _pending_events = 0
+    _last_flush = time.monotonic()
+    return batch
+
+
+def flush():
+    """Write the buffered counters now, in the calling thread"""
+    with _lock:
+        if not _pending:
+            return
+        batch = _take_pending()
+    _flush(*batch)
+
+
+def _ensure_timer():
+    """Start the flush timer of this process (threads do not survive a fork)"""
+    if _timer["pid"] == os.getpid():
+        return
+    with _lock:
+        if _timer["pid"] == os.getpid():
+            return
+        _timer["pid"] = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            flush()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _flush(pending, fields_to_set):
+    """Add buffered counters to their collections"""
+    by_collection = {}
+    for (collection, doc_id), amounts in pending.items():
+        update = {"$inc": dict(amounts)}
+        if (collection, doc_id) in fields_to_set:
+            update["$set"] = fields_to_set[(collection, doc_id)]
+        by_collection.setdefault(collection, []).append(
+            UpdateOne({"_id": doc_id}, update, upsert=True)
+        )
+    try:
+        db = get_db()
+        for collection, updates in by_collection.items():
+            db[collection].bulk_write(updates, ordered=False)
+    except Exception as e:
+        logger.warning(f"Failed to write search stats: {str(e)}")
+
+
+def totals(doc_id):
+    """Return the counters stored for a document of the stats collection"""
+    doc = get_db()[STATS_COLLECTION].find_one({"_id": doc_id}) or {}
+    doc.pop("_id", None)
+    return doc
+
+
+# Flush what is left when the process exits (development server; gunicorn
+# workers flush in the worker_exit hook)
+atexit.register(flush)
@@ -0,0 +1,172 @@
+import gc
+import logging
+import os
+import threading
+import time
+import certifi
+import params
+from pymongo import MongoClient
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Registered read-only structures: name -> loader function
+_loaders = {}
+# Loaded values: name -> object returned by the loader
+_values = {}
+# Wall-clock time each structure was last loaded successfully
+_loaded_at = {}
+# _id of the reload marker document in the search config collection
+MARKER_ID = "cache_generation"
+# Seconds between two reads of the reload marker
+MARKER_POLL_INTERVAL = int(os.environ.get('CACHE_POLL_INTERVAL', 30))
+# Incremented every time the structures are (re)loaded
+_generation = 0
+_lock = threading.Lock()
+
+
+def register(name, loader):
+    """
+    Register a large read-only structure that should be shared between workers.
+
+    Structures are loaded once in the gunicorn master (``preload_app``) so that
+    forked workers share them through copy-on-write instead of each worker
+    building its own copy. They must not be mutated after loading; a reload
+    swaps in a new object instead.
+
+    Args:
+        name (str): Name used to look the structure up with ``get``
+        loader (callable): Function with no arguments returning the structure
+    """
+    with _lock:
+        _loaders[name] = loader
+
+
+def get(name):
+    """
+    Return a shared structure, loading it on first use if it is not loaded yet.
+
+    Args:
+        name (str): Name the structure was registered under
+
+    Returns:
+        The object returned by the registered loader
+    """
+    if name not in _values and name in _loaders:
+        with _lock:
+            if name not in _values:
+                _values[name] = _load(name)
+    return _values.get(name)
+
+
+def age(name):
+    """Return the seconds since a structure was last loaded, or None if never"""
+    loaded_at = _loaded_at.get(name)
+    return time.time() - loaded_at if loaded_at is not None else None
+
+
+def generation():
+    """Return the number of times the shared structures have been loaded"""
+    return _generation
+
+
+def _load(name):
+    """Run a single loader, keeping the previous value if it fails"""
+    try:
+        value = _loaders[name]()
+        _loaded_at[name] = time.time()
+        logger.info(f"Loaded shared structure '{name}'")
+        return value
+    except Exception as e:
+        logger.error(f"Failed to load shared structure '{name}': {str(e)}", exc_info=True)
+        return _values.get(name)
+
+
+def reload(name):
+    """
+    Reload a single structure in this process only.
+
+    Used for TTL refreshes inside a worker; unlike a marker reload the new
+    copy is private to the worker.
+    """
+    with _lock:
+        if name in _loaders:
+            _values[name] = _load(name)
+
+
+def load_all():
+    """
+    Load (or reload) every registered structure.
+
+    Called once in the gunicorn master before forking workers, and again when
+    the reload marker moves after an ingest, so the next generation of
+    workers inherits the fresh copies.
+    """
+    global _generation
+    with _lock:
+        for name in list(_loaders):
+            _values[name] = _load(name)
+        _generation += 1
+    logger.info(f"Shared structures loaded (generation {_generation})")
+
+
+def freeze():
+    """
+    Move everything allocated so far into the permanent GC generation.
+
+    The cyclic garbage collector writes to the header of every object it
+    visits, which would touch (and therefore copy) the pages holding the
+    shared structures in each worker. Freezing them before forking keeps the
+    pages shared.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def publish_reload():
+    """
+    Tell every API node to reload the shared structures.
+
+    Used by ingest jobs such as vectorize_data.py. Bumps the generation marker
+    in the search config collection; the gunicorn master of each node polls it
+    (see ``watch_marker``) and reloads when it changes, so the job does not
+    need to run on the same host as the server.
+    """
+    with MongoClient(params.mongodb_conn_string, tlsCAFile=certifi.where()) as client:
+        client[params.db_name][params.search_config_collection].update_one(
+            {"_id": MARKER_ID},
+            {"$inc": {"generation": 1}, "$set": {"published_at": time.time()}},
+            upsert=True
+        )
+    logger.info("Published reload of the shared structures")
+
+
+def _read_marker(client):
+    """Return the published generation, or 0 if none has been published"""
+    marker = client[params.db_name][params.search_config_collection].find_one({"_id": MARKER_ID})
+    return marker.get("generation", 0) if marker else 0
+
+
+def watch_marker(on_change, interval=MARKER_POLL_INTERVAL):
+    """
+    Poll the generation marker in a daemon thread and call ``on_change`` when
+    it moves.
+
+    Started once in the gunicorn master; ``on_change`` signals the master to
+    reload, which reloads the structures and replaces the workers.
+    """
+    def run():
+        client = MongoClient(params.mongodb_conn_string, tlsCAFile=certifi.where())
+        last = None
+        while True:
+            try:
+                current = _read_marker(client)
+                if last is not None and current != last:
+                    logger.info(f"Reload marker moved to generation {current}")
+                    on_change()
+                last = current
+            except Exception as e:
+                logger.warning(f"Failed to read reload marker: {str(e)}")
+            time.sleep(interval)
+
+    threading.Thread(target=run, daemon=True).start()
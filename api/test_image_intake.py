@@ -0,0 +1,78 @@
+import io
+import struct
+import PIL.Image
+import pytest
+from flask import Flask, jsonify, request
+from image_intake import HeaderCheckedFile, ImageIntakeRequest, ImageRejected, inspect_header
+
+
+def make_jpeg(width=300, height=200, app1_bytes=0):
+    """Encode a JPEG, optionally with large APP1 segments before the frame header"""
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (width, height), "red").save(buffer, format="JPEG")
+    data = buffer.getvalue()
+    segments = b''
+    while app1_bytes > 0:
+        body = b'\0' * min(app1_bytes, 65533)
+        segments += b'\xff\xe1' + struct.pack('>H', len(body) + 2) + body
+        app1_bytes -= len(body)
+    return data[:2] + segments + data[2:]
+
+
+def feed(data, chunk_size=8192):
+    checked = HeaderCheckedFile(io.BytesIO())
+    for start in range(0, len(data), chunk_size):
+        checked.write(data[start:start + chunk_size])
+    return checked
+
+
+def test_jpeg_with_large_app_segments_is_accepted():
+    data = make_jpeg(app1_bytes=90 * 1024)
+    assert PIL.Image.open(io.BytesIO(data)).size == (300, 200)
+
+    checked = feed(data)
+
+    assert checked.image_info == ('JPEG', 300, 200)
+    checked.seek(0)
+    assert checked.read() == data
+
+
+def test_jpeg_upload_with_large_app_segments_over_multipart():
+    app = Flask(__name__)
+    app.request_class = ImageIntakeRequest
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        try:
+            image = request.files['image']
+        except ImageRejected as e:
+            return jsonify({"error": str(e)}), e.status_code
+        return jsonify({"size": list(image.stream.image_info[1:])})
+
+    data = make_jpeg(app1_bytes=90 * 1024)
+    response = app.test_client().post(
+        '/upload', data={"image": (io.BytesIO(data), "photo.jpg")},
+        content_type="multipart/form-data"
+    )
+
+    assert response.status_code == 200
+    assert response.get_json() == {"size": [300, 200]}
+
+
+def test_png_and_gif_headers():
+    for image_format in ("PNG", "GIF"):
+        buffer = io.BytesIO()
+        PIL.Image.new("RGB", (64, 32)).save(buffer, format=image_format)
+        assert inspect_header(buffer.getvalue()) == (image_format, 64, 32)
+
+
+def test_non_image_is_rejected():
+    with pytest.raises(ImageRejected):
+        feed(b'not an image at all')
+
+
+def test_oversized_image_is_rejected_from_header():
+    header = b'GIF89a' + struct.pack('<HH', 60000, 60000)
+    with pytest.raises(ImageRejected) as excinfo:
+        feed(header)
+    assert excinfo.value.status_code == 413
@@ -8,6 +8,9 @@ from pymongo import MongoClient
 from dotenv import dotenv_values
 import params
 import time
+import shared_cache
+import embedding_versions
+import precompute_head_queries
 
 
 config = dotenv_values(".env")
@@ -69,91 +72,60 @@ except Exception as e:
     print(f"Error configuring Gemini API: {e}")
     exit(1)
 
-# Create a custom embedding function for Gemini
-class GeminiEmbeddings:
-    def __init__(self, model="models/embedding-001"):
-        self.model = model
-    
-    def embed_documents(self, texts):
-        """Embed a list of documents"""
-        embeddings = []
-        for i, text in enumerate(texts):
-            try:
-                result = genai.embed_content(
-                    model=self.model,
-                    content=text
-                )
-                embeddings.append(result['embedding'])
-                if (i + 1) % 50 == 0:  # Progress indicator
-                    print(f"Embedded {i + 1}/{len(texts)} documents")
-            except Exception as e:
-                print(f"Error embedding document {i}: {e}")
-                # Use zero vector as fallback
-                embeddings.append([0.0] * 768)
-        return embeddings
-    
-    def embed_query(self, text):
-        """Embed a single query"""
-        try:
-            result = genai.embed_content(
-                model=self.model,
-                content=text
-            )
-            return result['embedding']
-        except Exception as e:
-            print(f"Error embedding query: {e}")
-            return [0.0] * 768
-
-# Initialize the custom embeddings class
-embeddings = GeminiEmbeddings()
-
-# Step 4: Store
+# Embed with the active embedding version
 print("Connecting to MongoDB...")
-# Initialize MongoDB python client
 client = MongoClient(params.mongodb_conn_string)
 db = client[params.db_name]
+version = embedding_versions.get_config(db)["active"]
+spec = embedding_versions.get_spec(version)
+print(f"Using embedding version {version} ({spec['model']}, {spec['dimensions']} dimensions)")
+embeddings = embedding_versions.embeddings_for(version)
+
+# Tag every document with the versions its vectors were built with
+for doc in docs:
+    doc.metadata["embedding_versions"] = [version]
+
+# Step 4: Store
 collection = db[params.collection_name]
 
 # Reset without deleting the Search Index 
 print("Deleting existing documents...")
 collection.delete_many({})
 
+# Only the active version is embedded below, so any shadow vectors are gone:
+# stop comparing against the shadow until it has been rebuilt
+shadow = embedding_versions.get_config(db)["shadow"]
+if shadow:
+    embedding_versions.set_shadow(db, shadow, dual_read=False)
+    print(f"Dual-read turned off; run 'migrate_embeddings.py build {shadow}' to rebuild the shadow version")
+
 
 # Try to create the vector search index if it doesn't exist
 try:
-    print(f"Checking for vector search index '{params.index_name}'...")
+    print(f"Checking for vector search index '{spec['index_name']}'...")
     # List all indexes to see if our vector index exists
     indexes = list(collection.list_indexes())
     print(indexes)
     index_exists = False
     for index in indexes:
-        if index.get('name') == params.index_name:
+        if index.get('name') == spec['index_name']:
             index_exists = True
-            print(f"Vector index '{params.index_name}' already exists")
+            print(f"Vector index '{spec['index_name']}' already exists")
             break
     
     if not index_exists:
-        print(f"Creating vector search index '{params.index_name}'...")
+        print(f"Creating vector search index '{spec['index_name']}'...")
         # Create the vector search index
-        index_definition = {
-            "fields": [
-                {
-                    "type": "vector",
-                    "path": "embedding",
-                    "numDimensions": 768,  # Gemini embedding-001 has 768 dimensions
-                    "similarity": "cosine"
-                }
-            ]
-        }
+        index_definition = embedding_versions.index_definition(version)
         
         # Try to create the search index
         try:
             db.command({
                 "createSearchIndex": params.collection_name,
-                "name": params.index_name,
+                "name": spec['index_name'],
                 "definition": index_definition
             })
-            print(f"Created vector search index '{params.index_name}'")
+            print(f"Created vector search index '{spec['index_name']}'")
         except Exception as e:
             print(f"Error creating search index: {e}")
 except Exception as e:
@@ -162,7 +134,8 @@ except Exception as e:
 # Insert the documents in MongoDB Atlas with their embedding
 print("Storing documents with embeddings...")
 docsearch = MongoDBAtlasVectorSearch.from_documents(
-    docs, embeddings, collection=collection, index_name=params.index_name
+    docs, embeddings, collection=collection, index_name=spec['index_name'],
+    embedding_key=spec['field']
 )
 
 # Verify documents were inserted
@@ -171,16 +144,49 @@ print(f"Inserted {count} documents")
 
 # Check if a document has an embedding field
 doc = collection.find_one()
-if doc and 'embedding' in doc:
-    print(f"Embeddings stored correctly. Vector dimension: {len(doc['embedding'])}")
+if doc and spec['field'] in doc:
+    print(f"Embeddings stored correctly. Vector dimension: {len(doc[spec['field']])}")
 else:
     print("WARNING: Embeddings not found in documents")
     if doc:
         print(f"Fields in document: {list(doc.keys())}")
 
-# Wait a moment for the index to be ready
-print("Waiting a moment for the index to be ready...")
-time.sleep(2)
+# Wait until Atlas Search has indexed the new documents. Indexing is
+# eventually consistent, so poll the index status and check that the last
+# inserted documents can be found by their own stored vectors. Results are
+# compared by content, since the CSV has products with duplicate content,
+# and the stored vectors are reused so polling makes no Gemini calls.
+INDEX_WAIT_TIMEOUT = int(os.getenv("INDEX_WAIT_TIMEOUT", 600))
+print("Waiting for the index to catch up...")
+probes = list(collection.find(
+    {"index": {"$in": [d.metadata['index'] for d in docs[-3:]]}},
+    {"text": 1, spec['field']: 1}
+))
+index_ready = False
+deadline = time.time() + INDEX_WAIT_TIMEOUT
+while time.time() < deadline:
+    try:
+        status = list(collection.list_search_indexes(spec['index_name']))
+        if status and status[0].get('queryable') and status[0].get('status') == 'READY':
+            index_ready = all(
+                [hit.get('text') for hit in collection.aggregate([
+                    {"$vectorSearch": {
+                        "index": spec['index_name'],
+                        "path": spec['field'],
+                        "queryVector": probe[spec['field']],
+                        "numCandidates": 50,
+                        "limit": 1
+                    }},
+                    {"$project": {"text": 1}}
+                ])] == [probe.get('text')]
+                for probe in probes
+            )
+        if index_ready:
+            break
+    except Exception as e:
+        print(f"Error checking index status: {e}")
+    time.sleep(5)
+print("Index is ready" if index_ready else "WARNING: Index did not catch up before the timeout")
 
 # Test a search
 print("Testing search functionality...")
@@ -194,4 +200,21 @@ try:
 except Exception as e:
     print(f"Error during search test: {e}")
 
-print("Amazon product vectorization with Gemini embeddings complete!")
\ No newline at end of file
+print("Amazon product vectorization with Gemini embeddings complete!")
+
+# Refresh the precomputed head-query results against the new data. Results
+# computed against a partially built index would be cached as wrong answers,
+# so keep the previous ones if the index is not ready.
+if index_ready:
+    print("Refreshing head-query results...")
+    try:
+        precompute_head_queries.precompute()
+    except Exception as e:
+        # The ingest itself succeeded; still publish the reload below
+        print(f"Error refreshing head-query results: {e}")
+else:
+    print("Skipping head-query refresh; run precompute_head_queries.py once the index is ready")
+
+# Ask the running API server to reload its shared structures
+print("Requesting reload of the API server's shared structures...")
+shared_cache.publish_reload()